@@ -32,7 +32,7 @@
 # THE POSSIBILITY OF SUCH DAMAGE.
 
 from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
-from contextlib import AbstractContextManager
+from contextlib import AbstractContextManager, ExitStack
 import io
 import inspect
 import pandas as pd
@@ -50,7 +50,7 @@ from skorch.callbacks import PassthroughScoring
 from skorch.callbacks.base import _issue_warning_if_on_batch_override
 from skorch.dataset import Dataset as SkorchDataset, unpack_data
 from skorch.history import History
-from skorch.utils import to_tensor
+from skorch.utils import get_len
 
 import torch
 from torch.nn.parallel.distributed import DistributedDataParallel
@@ -68,9 +68,10 @@ from ray_skorch.dataset import (FixedSplit, PipelineIterator,
 from ray_skorch.docs import (set_ray_train_neural_net_docs,
                              set_worker_neural_net_docs)
 
-from ray_skorch.utils import (add_callback_if_not_already_in,
-                              is_in_train_session, is_dataset_or_ray_dataset,
-                              get_params_io)
+from ray_skorch.utils import (
+    add_callback_if_not_already_in, cast_floating_tensors, is_in_train_session,
+    is_dataset_or_ray_dataset, get_params_io, is_cuda_device,
+    to_tensor_non_blocking, unwrap_compiled, unwrap_module)
 
 _warned = False
 
@@ -120,10 +121,16 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
                  profile: bool = False,
                  save_checkpoints: bool = False,
                  ddp_kwargs: Optional[Dict[str, Any]] = None,
+                 compile_kwargs: Optional[Dict[str, Any]] = None,
+                 autocast_kwargs: Optional[Dict[str, Any]] = None,
+                 defer_batch_loss: bool = False,
                  **kwargs):
         self.profile = profile
         self.save_checkpoints = save_checkpoints
         self.ddp_kwargs = ddp_kwargs
+        self.compile_kwargs = compile_kwargs
+        self.autocast_kwargs = autocast_kwargs
+        self.defer_batch_loss = defer_batch_loss
         super().__init__(
             module,
             criterion,
@@ -237,11 +244,28 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
             self.callbacks_.append(report_callback)
         return self
 
+    def compile_module(self):
+        if unwrap_compiled(self.module_) is not self.module_:
+            return self
+        if not hasattr(torch, "compile"):
+            raise RuntimeError("`compile_kwargs` requires torch>=2.0, got "
+                               f"{torch.__version__}.")
+        compile_kwargs = {**{"dynamic": False}, **self.compile_kwargs}
+        self.module_ = torch.compile(self.module_, **compile_kwargs)
+        return self
+
     # TODO make this a callback
     def wrap_module_in_ddp(self):
-        if not isinstance(self.module_, DistributedDataParallel):
-            ddp_kwargs = self.ddp_kwargs or {}
-            ddp_kwargs = {**{"find_unused_parameters": True}, **ddp_kwargs}
+        if not isinstance(
+                unwrap_compiled(self.module_), DistributedDataParallel):
+            # gradient_as_bucket_view avoids copying gradients into
+            # the allreduce buckets, as long as the gradients are not
+            # set to None between steps (see ``_zero_grad_optimizer``)
+            ddp_kwargs = {
+                "find_unused_parameters": True,
+                "gradient_as_bucket_view": True,
+                **(self.ddp_kwargs or {})
+            }
             self.module_ = train.torch.prepare_model(
                 self.module_, ddp_kwargs=ddp_kwargs)
         return self
@@ -266,6 +290,14 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
     def iterator_valid_(self, val):
         self._iterator_valid_ = val
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        # The initialized iterators hold Ray Dataset pipeline generators,
+        # which cannot be pickled. They are recreated when needed.
+        state.pop("_iterator_train_", None)
+        state.pop("_iterator_valid_", None)
+        return state
+
     def get_iterator(self, dataset, training=False):
         if training:
             initalized_iterator = self.iterator_train_
@@ -287,6 +319,20 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
         if kwargs["batch_size"] == -1:
             kwargs["batch_size"] = len(dataset)
 
+        is_pipeline_iterator = isinstance(iterator, type) and issubclass(
+            iterator, PipelineIterator)
+
+        # pin memory so that host to device copies can be asynchronous
+        if is_pipeline_iterator and "pin_memory" not in kwargs:
+            kwargs["pin_memory"] = is_cuda_device(self.device)
+
+        # drop the last incomplete batch so that a module compiled with
+        # static shapes doesn't need to be recompiled
+        if (training and is_pipeline_iterator and "drop_last" not in kwargs
+                and self.compile_kwargs is not None
+                and not self.compile_kwargs.get("dynamic", False)):
+            kwargs["drop_last"] = True
+
         initalized_iterator = iterator(dataset, **kwargs)
 
         if training:
@@ -315,6 +361,11 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
 
         self.notify("on_train_begin", X=X, y=y)
         self.wrap_module_in_ddp()
+        # compile the DDP-wrapped module, so that the compiled graph is
+        # split at bucket boundaries and allreduce can overlap with the
+        # backward pass. Prediction is a single pass and isn't compiled.
+        if self.compile_kwargs is not None:
+            self.compile_module()
         try:
             self.fit_loop(X, y, X_val=X_val, y_val=y_val, **fit_params)
         except KeyboardInterrupt:
@@ -371,14 +422,103 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
             self.notify("on_epoch_end", **on_epoch_kwargs)
         return self
 
+    def run_single_epoch(self, dataset, training, prefix, step_fn,
+                         **fit_params):
+        """Compute a single epoch of train or validation.
+
+        If ``defer_batch_loss`` is True, batch losses are kept on device
+        and are only copied to host (and recorded in history) once at
+        the end of the epoch, in order to avoid a device synchronization
+        after every batch. This means that the batch losses are not
+        available in history during ``on_batch_end``.
+        """
+        if dataset is None:
+            return
+
+        iterator = self.get_iterator(dataset, training=training)
+
+        # all batches have the same size if the last one is dropped
+        initialized_iterator = (self.iterator_train_
+                                if training else self.iterator_valid_)
+        if getattr(initialized_iterator, "drop_last", False):
+            fixed_batch_size = initialized_iterator.batch_size
+        else:
+            fixed_batch_size = None
+
+        batch_count = 0
+        batch_losses = []
+        first_batch_idx = len(self.history[-1]["batches"])
+        for batch in iterator:
+            self.notify("on_batch_begin", batch=batch, training=training)
+            step = step_fn(batch, **fit_params)
+            if self.defer_batch_loss:
+                batch_losses.append(step["loss"].detach())
+            else:
+                self.history.record_batch(prefix + "_loss",
+                                          step["loss"].item())
+            if fixed_batch_size is not None:
+                batch_size = fixed_batch_size
+            else:
+                batch_size = (get_len(batch[0]) if isinstance(
+                    batch, (tuple, list)) else get_len(batch))
+            self.history.record_batch(prefix + "_batch_size", batch_size)
+            self.notify("on_batch_end", batch=batch, training=training, **step)
+            batch_count += 1
+
+        if batch_losses:
+            batch_losses = torch.stack(batch_losses).cpu().tolist()
+            batches = self.history[-1]["batches"][first_batch_idx:]
+            for batch_history, loss in zip(batches, batch_losses):
+                batch_history[prefix + "_loss"] = loss
+
+        self.history.record(prefix + "_batch_count", batch_count)
+
+    def _zero_grad_optimizer(self, set_to_none=None):
+        if set_to_none is None:
+            # Setting the gradients to None is cheaper than zeroing them
+            # out, unless they are views of the DDP allreduce buckets -
+            # new gradients would then be copied into the buckets again
+            ddp_module = unwrap_compiled(self.module_)
+            is_bucket_view = isinstance(
+                ddp_module, DistributedDataParallel) and getattr(
+                    ddp_module, "gradient_as_bucket_view", False)
+            set_to_none = not is_bucket_view
+        return super()._zero_grad_optimizer(set_to_none=set_to_none)
+
+    def get_autocast_context(self) -> AbstractContextManager:
+        """Context manager for the training forward pass and loss.
+
+        If ``autocast_kwargs`` is set, returns ``torch.autocast``
+        (bfloat16 by default), otherwise a no-op context manager.
+        """
+        if self.autocast_kwargs is None:
+            return ExitStack()
+        autocast_kwargs = {
+            "device_type": torch.device(self.device).type,
+            "dtype": torch.bfloat16,
+            **self.autocast_kwargs
+        }
+        return torch.autocast(**autocast_kwargs)
+
+    def get_module_dtype(self) -> "torch.dtype":
+        """Get the dtype of the floating point parameters of the module."""
+        return next((param.dtype for param in self.module_.parameters()
+                     if param.is_floating_point()), torch.get_default_dtype())
+
     def train_step_single(self, batch, **fit_params):
         self._set_training(True)
         Xi, yi = unpack_data(batch)
-        y_pred = self.infer(Xi, **fit_params)
-        loss = self.get_loss(y_pred, yi, X=Xi, training=True)
+        # backward pass is run outside of autocast, as recommended
+        with self.get_autocast_context():
+            y_pred = self.infer(Xi, **fit_params)
+            loss = self.get_loss(y_pred, yi, X=Xi, training=True)
         self.notify("on_backward_pass_begin", X=Xi, y=yi)
         loss.backward()
         self.notify("on_backward_pass_end", X=Xi, y=yi)
+        if self.autocast_kwargs is not None:
+            # skorch can't convert low precision predictions to numpy,
+            # eg. for EpochScoring(on_train=True)
+            y_pred = cast_floating_tensors(y_pred, self.get_module_dtype())
         return {
             "loss": loss,
             "y_pred": y_pred,
@@ -386,7 +526,7 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
 
     def infer(self, x, **fit_params):
         self.notify("on_X_to_device_begin", X=x)
-        x = to_tensor(x, device=self.device)
+        x = to_tensor_non_blocking(x, device=self.device)
         self.notify("on_X_to_device_end", X=x)
         self.notify("on_forward_pass_begin", X=x)
         if isinstance(x, dict):
@@ -402,7 +542,7 @@ class _WorkerRayTrainNeuralNet(NeuralNet):
     # pylint: disable=unused-argument
     def get_loss(self, y_pred, y_true, X=None, training=False):
         self.notify("on_y_to_device_begin", y=y_true)
-        y_true = to_tensor(y_true, device=self.device)
+        y_true = to_tensor_non_blocking(y_true, device=self.device)
         self.notify("on_y_to_device_end", y=y_true)
         return self.criterion_(y_pred, y_true)
 
@@ -444,6 +584,9 @@ class RayTrainNeuralNet(NeuralNet):
                  profile: bool = False,
                  save_checkpoints: bool = False,
                  ddp_kwargs: Optional[Dict[str, Any]] = None,
+                 compile_kwargs: Optional[Dict[str, Any]] = None,
+                 autocast_kwargs: Optional[Dict[str, Any]] = None,
+                 defer_batch_loss: bool = False,
                  **kwargs):
         global _warned
         if not _warned:
@@ -462,6 +605,9 @@ class RayTrainNeuralNet(NeuralNet):
         self.save_checkpoints = save_checkpoints
         self.train_callbacks = train_callbacks
         self.ddp_kwargs = ddp_kwargs
+        self.compile_kwargs = compile_kwargs
+        self.autocast_kwargs = autocast_kwargs
+        self.defer_batch_loss = defer_batch_loss
         super().__init__(
             module,
             criterion,
@@ -629,8 +775,8 @@ class RayTrainNeuralNet(NeuralNet):
                 estimator.set_params(device=original_device)
                 output = get_params_io()
                 # get the module from inside DistributedDataParallel
-                if isinstance(estimator.module_, DistributedDataParallel):
-                    estimator.module_ = estimator.module_.module
+                # and torch.compile
+                estimator.module_ = unwrap_module(estimator.module_)
                 estimator.save_params(**output)
                 output = {k: v.getvalue() for k, v in output.items()}
             else:
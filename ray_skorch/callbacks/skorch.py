@@ -1,20 +1,21 @@
 import time
 import os
+import gzip
 import io
-import pickle
 from typing import (Any, Callable, Dict, Iterable, Optional, Union,
                     TYPE_CHECKING)
 from skorch.callbacks.training import Checkpoint
 
-from torch.nn.parallel.distributed import DistributedDataParallel
-from torch.profiler import profile, record_function, ProfilerActivity
+import torch
+from torch.profiler import (profile, record_function, ProfilerActivity,
+                            ProfilerAction)
 
 from ray import train
 
 from skorch.callbacks import Callback, EpochTimer
 from skorch.utils import _check_f_arguments, noop
 
-from ray_skorch.utils import is_using_gpu
+from ray_skorch.utils import is_using_gpu, unwrap_module
 from ray_skorch.callbacks.constants import PROFILER_KEY
 from ray_skorch.callbacks.utils import SortedKeysMixin
 
@@ -71,36 +72,76 @@ class PerformanceLogger(TrainSklearnCallback):
         * Backward pass
         * X to device
         * y to device
+
+    Host to device copies on GPU are non-blocking, so ``to_device_dur_s``
+    only measures the time taken to enqueue the copies, not the copies
+    themselves.
+
+    Args:
+        record_every (int): Only every ``record_every``-th batch is timed
+            and recorded, starting with the first one. Training and
+            validation batches are counted separately. The rest of the
+            batches will not have the duration keys in history.
+            Must be at least 1. Defaults to 1.
     """
 
-    def __init__(self, **kwargs) -> None:
+    def __init__(self, record_every: int = 1, **kwargs) -> None:
+        if record_every < 1:
+            raise ValueError(
+                f"record_every must be at least 1, got {record_every}.")
+        self.record_every = record_every
         super().__init__(**kwargs)
 
+    def initialize(self):
+        # batch counts for validation (False) and training (True)
+        self.batch_idx_ = {False: 0, True: 0}
+        self.record_batch_ = True
+        return super().initialize()
+
+    def on_batch_begin(self, net, batch=None, training=None, **kwargs):
+        training = bool(training)
+        self.record_batch_ = self.batch_idx_[training] % self.record_every == 0
+        self.batch_idx_[training] += 1
+
     def on_forward_pass_begin(self, net, X=None, **kwargs):
-        self.forward_pass_time_ = time.time()
+        if self.record_batch_:
+            self.forward_pass_time_ = time.perf_counter()
 
     def on_forward_pass_end(self, net, X=None, **kwargs):
-        self.forward_pass_time_ = time.time() - self.forward_pass_time_
+        if self.record_batch_:
+            self.forward_pass_time_ = (
+                time.perf_counter() - self.forward_pass_time_)
 
     def on_backward_pass_begin(self, net, X=None, y=None, **kwargs):
-        self.backward_pass_time_ = time.time()
+        if self.record_batch_:
+            self.backward_pass_time_ = time.perf_counter()
 
     def on_backward_pass_end(self, net, X=None, y=None, **kwargs):
-        self.backward_pass_time_ = time.time() - self.backward_pass_time_
+        if self.record_batch_:
+            self.backward_pass_time_ = (
+                time.perf_counter() - self.backward_pass_time_)
 
     def on_X_to_device_begin(self, net, X=None, **kwargs):
-        self.X_to_device_time_ = time.time()
+        if self.record_batch_:
+            self.X_to_device_time_ = time.perf_counter()
 
     def on_X_to_device_end(self, net, X=None, **kwargs):
-        self.X_to_device_time_ = time.time() - self.X_to_device_time_
+        if self.record_batch_:
+            self.X_to_device_time_ = (
+                time.perf_counter() - self.X_to_device_time_)
 
     def on_y_to_device_begin(self, net, y=None, **kwargs):
-        self.y_to_device_time_ = time.time()
+        if self.record_batch_:
+            self.y_to_device_time_ = time.perf_counter()
 
     def on_y_to_device_end(self, net, y=None, **kwargs):
-        self.y_to_device_time_ = time.time() - self.y_to_device_time_
+        if self.record_batch_:
+            self.y_to_device_time_ = (
+                time.perf_counter() - self.y_to_device_time_)
 
     def on_batch_end(self, net, batch=None, training=None, **kwargs):
+        if not self.record_batch_:
+            return
         net.history.record_batch(
             "to_device_dur_s", self.X_to_device_time_ + self.y_to_device_time_)
         net.history.record_batch("forward_pass_dur_s", self.forward_pass_time_)
@@ -112,7 +153,8 @@ class PytorchProfilerLogger(TrainSklearnCallback):
     """Saves the profiler state to worker history so that it can be retrieved
     by Ray Train during ``train.report()`` (through ``TrainReportCallback``).
 
-    Saves and reports the trace at training end.
+    Saves and reports the trace at training end. Traces are reported
+    as gzip-compressed chrome traces.
 
     Operations logged:
         * Batch
@@ -124,15 +166,31 @@ class PytorchProfilerLogger(TrainSklearnCallback):
     Args:
         profiler_args (Optional[Dict[str, Any]]): kwargs passed to
         ``torch.profiler.profile()`
+        capture_every (Optional[int]): If set, traces ready during training
+            are only exported every ``capture_every`` epochs, starting with
+            the first one. The trace at training end is always exported.
+            Must be at least 1 if set. Defaults to None (export every
+            trace).
     """
 
     def __init__(self,
                  profiler_args: Optional[Dict[str, Any]] = None,
+                 capture_every: Optional[int] = None,
                  **kwargs) -> None:
+        if capture_every is not None and capture_every < 1:
+            raise ValueError(
+                f"capture_every must be at least 1, got {capture_every}.")
         self.profiler_args = profiler_args
+        self.capture_every = capture_every
         super().__init__(**kwargs)
 
     def _trace_handler(self, p: profile):
+        if (self.capture_every is not None
+                and (self.epoch_ - 1) % self.capture_every):
+            return
+        self._export_trace(p)
+
+    def _export_trace(self, p: profile):
         dir_name = "pytorch_profiler_trace"
         if not os.path.isdir(dir_name):
             try:
@@ -141,15 +199,17 @@ class PytorchProfilerLogger(TrainSklearnCallback):
                 raise RuntimeError("Can't create directory: " + dir_name)
         filename = f"worker_{self.worker_rank_}_{self.epoch_}.pt.trace.json"
         path = os.path.join(dir_name, filename)
-        # TODO consider compression
         try:
             p.export_chrome_trace(path)
-            with open(path) as f:
-                data = f.read()
-            self.profiler_traces_.append((filename, data, p.events()))
         except RuntimeError:
             # trace is already saved
-            pass
+            return
+        # Compress the trace, as it is sent through Ray object store.
+        # p.events() is not sent, as it is slow to pickle.
+        with open(path, "rb") as f:
+            data = gzip.compress(f.read())
+        os.remove(path)
+        self.profiler_traces_.append((f"{filename}.gz", data, None))
 
     def on_train_begin(self, net, X=None, y=None, **kwargs):
         self.has_gpu_ = is_using_gpu(net.device)
@@ -164,6 +224,7 @@ class PytorchProfilerLogger(TrainSklearnCallback):
         self.worker_rank_ = train.world_rank()
         self.epoch_ = 0
         self.record_functions_ = {}
+        self.is_recording_ = self._is_recording()
         self.profiler_ = profile(**self.profiler_args_)
         self.profiler_.__enter__()
         self.profiler_is_initialized_ = True
@@ -171,53 +232,64 @@ class PytorchProfilerLogger(TrainSklearnCallback):
     def on_train_end(self, net, X=None, y=None, **kwargs):
         if self.profiler_is_initialized_:
             self.profiler_.__exit__(None, None, None)
-            self._trace_handler(self.profiler_)
+            self._export_trace(self.profiler_)
             self.profiler_is_initialized_ = False
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The profiler, its schedule and the record functions cannot be
+        # pickled. They are recreated in ``on_train_begin``.
+        for key in ("profiler_", "profiler_args_", "record_functions_",
+                    "profiler_traces_"):
+            state.pop(key, None)
+        if state.get("profiler_is_initialized_"):
+            state["profiler_is_initialized_"] = False
+        return state
+
+    def _is_recording(self) -> bool:
+        # The profiler is stepped every epoch, so the epoch is the step
+        # number. Nothing is recorded during the WAIT phase of schedule.
+        schedule = self.profiler_args_.get("schedule")
+        return schedule is None or schedule(self.epoch_) != ProfilerAction.NONE
+
+    def _enter_record_function(self, record_name: str):
+        if self.is_recording_:
+            self.record_functions_[record_name] = record_function(
+                record_name).__enter__()
+
+    def _exit_record_function(self, record_name: str):
+        if self.is_recording_:
+            self.record_functions_[record_name].__exit__(None, None, None)
+
     def on_forward_pass_begin(self, net, X=None, **kwargs):
-        record_name = "forward_pass"
-        self.record_functions_[record_name] = record_function(
-            record_name).__enter__()
+        self._enter_record_function("forward_pass")
 
     def on_forward_pass_end(self, net, X=None, **kwargs):
-        record_name = "forward_pass"
-        self.record_functions_[record_name].__exit__(None, None, None)
+        self._exit_record_function("forward_pass")
 
     def on_backward_pass_begin(self, net, X=None, y=None, **kwargs):
-        record_name = "backward_pass"
-        self.record_functions_[record_name] = record_function(
-            record_name).__enter__()
+        self._enter_record_function("backward_pass")
 
     def on_backward_pass_end(self, net, X=None, y=None, **kwargs):
-        record_name = "backward_pass"
-        self.record_functions_[record_name].__exit__(None, None, None)
+        self._exit_record_function("backward_pass")
 
     def on_X_to_device_begin(self, net, X=None, **kwargs):
-        record_name = "X_to_device"
-        self.record_functions_[record_name] = record_function(
-            record_name).__enter__()
+        self._enter_record_function("X_to_device")
 
     def on_X_to_device_end(self, net, X=None, **kwargs):
-        record_name = "X_to_device"
-        self.record_functions_[record_name].__exit__(None, None, None)
+        self._exit_record_function("X_to_device")
 
     def on_y_to_device_begin(self, net, y=None, **kwargs):
-        record_name = "y_to_device"
-        self.record_functions_[record_name] = record_function(
-            record_name).__enter__()
+        self._enter_record_function("y_to_device")
 
     def on_y_to_device_end(self, net, y=None, **kwargs):
-        record_name = "y_to_device"
-        self.record_functions_[record_name].__exit__(None, None, None)
+        self._exit_record_function("y_to_device")
 
     def on_batch_begin(self, net, batch=None, training=None, **kwargs):
-        record_name = "batch"
-        self.record_functions_[record_name] = record_function(
-            record_name).__enter__()
+        self._enter_record_function("batch")
 
     def on_batch_end(self, net, batch=None, training=None, **kwargs):
-        record_name = "batch"
-        self.record_functions_[record_name].__exit__(None, None, None)
+        self._exit_record_function("batch")
 
     def on_epoch_begin(self,
                        net,
@@ -225,9 +297,8 @@ class PytorchProfilerLogger(TrainSklearnCallback):
                        dataset_valid=None,
                        **kwargs):
         self.profiler_traces_ = []
-        record_name = "epoch"
-        self.record_functions_[record_name] = record_function(
-            record_name).__enter__()
+        self.is_recording_ = self._is_recording()
+        self._enter_record_function("epoch")
 
     def on_epoch_end(self,
                      net,
@@ -235,8 +306,7 @@ class PytorchProfilerLogger(TrainSklearnCallback):
                      dataset_valid=None,
                      **kwargs):
         self.epoch_ += 1
-        record_name = "epoch"
-        self.record_functions_[record_name].__exit__(None, None, None)
+        self._exit_record_function("epoch")
         self.profiler_.step()
         net.history.record(
             PROFILER_KEY, self.profiler_traces_
@@ -251,7 +321,8 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
     """Save and load Ray Train checkpoints.
 
     By default, the checkpoint is saved every epoch. The behavior can
-    be modified by setting the ``monitor`` argument.
+    be modified by setting the ``monitor``, ``save_every`` and
+    ``save_last`` arguments.
 
     Args:
         monitor (Union[str, Callable[["_WorkerRayTrainNeuralNet"], bool]]):
@@ -266,15 +337,23 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
             checkpoint. Defaults to True.
         f_history (bool): Whether to save the head worker history in the
             checkpoint. Defaults to True.
-        f_pickle (bool): Whether to save the entire ``NeuralNet`` as a
-            pickle in the checkpoint. This is usually not necessary,
-            as all the necessary information is saved with other items,
-            but may be useful for debugging. Defaults to False.
+        f_pickle (bool): Whether to save the entire ``NeuralNet`` in the
+            checkpoint with ``torch.save`` (load it with ``torch.load``).
+            This is usually not necessary, as all the necessary
+            information is saved with other items, but may be useful for
+            debugging. Defaults to False.
         event_name (str):
             Name of event to be placed in history when checkpoint is
             triggered. Pass ``None`` to disable placing events in history.
         save_checkpoints (bool):
             Whether to save checkpoints at all. Defaults to True.
+        save_every (int):
+            Only consider saving a checkpoint every ``save_every`` epochs
+            (the ``monitor`` is only checked in those epochs). Must be
+            at least 1. Defaults to 1.
+        save_last (bool):
+            Whether to always save a checkpoint at the end of training if
+            the last epoch was not saved already. Defaults to False.
         load_checkpoint (bool):
             Whether to load a checkpoint if provided. Defaults to True.
         sink (callable):
@@ -296,9 +375,14 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
                  f_pickle: bool = False,
                  event_name: str = "event_cp",
                  save_checkpoints: bool = True,
+                 save_every: int = 1,
+                 save_last: bool = False,
                  load_checkpoint: bool = True,
                  sink: Callable = noop,
                  **kwargs):
+        if save_every < 1:
+            raise ValueError(
+                f"save_every must be at least 1, got {save_every}.")
         self.monitor = monitor
         self.f_params = f_params
         self.f_optimizer = f_optimizer
@@ -309,10 +393,17 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
         self.sink = sink
         self.load_checkpoint = load_checkpoint
         self.save_checkpoints = save_checkpoints
+        self.save_every = save_every
+        self.save_last = save_last
         self._check_kwargs(kwargs)
         vars(self).update(**kwargs)
 
     def initialize(self):
+        self.last_saved_epoch_ = None
+        # The items to save are the same every epoch, so they are
+        # resolved once - ``_f_kwargs`` iterates over ``dir(self)``.
+        self.save_kwargs_module_, self.save_kwargs_other_ = _check_f_arguments(
+            self.__class__.__name__, **self._f_kwargs())
         return self
 
     def on_train_begin(self, net, X=None, y=None, **kwargs):
@@ -342,11 +433,21 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
         return
 
     def on_train_end(self, net, **kwargs):
-        return
+        if not (self.save_checkpoints and self.save_last and net.history):
+            return
+        if net.history[-1]["epoch"] != self.last_saved_epoch_:
+            self.save_model(net)
+            self._sink("A checkpoint was triggered at the end of training.",
+                       net.verbose)
 
     def on_epoch_end(self, net, **kwargs):
         if not self.save_checkpoints:
             return
+        if net.history[-1]["epoch"] % self.save_every:
+            # keep the history schema the same in every epoch
+            if self.event_name is not None:
+                net.history.record(self.event_name, False)
+            return
         return super().on_epoch_end(net, **kwargs)
 
     def save_model(self, net):
@@ -362,16 +463,14 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
           - entire model object.
 
         """
-        kwargs_module, kwargs_other = _check_f_arguments(
-            self.__class__.__name__, **self._f_kwargs())
+        kwargs_module, kwargs_other = (self.save_kwargs_module_,
+                                       self.save_kwargs_other_)
 
         params = {}
 
-        # ensure a non DDP-wrapped module is saved
-        ddp_module = None
-        if isinstance(net.module_, DistributedDataParallel):
-            ddp_module = net.module_
-            net.module_ = net.module_.module
+        # ensure a non DDP-wrapped (or compiled) module is saved
+        wrapped_module = net.module_
+        net.module_ = unwrap_module(net.module_)
 
         for key, val in kwargs_module.items():
             if val is None:
@@ -384,32 +483,30 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
 
         f_history = kwargs_other.get("f_history")
         if f_history:
-            f = self.f_history_
+            f = self._get_io("f_history")
             params["f_history"] = self._save_params(f, net, "f_history",
                                                     "history")
 
         f_pickle = kwargs_other.get("f_pickle")
         if f_pickle:
-            f_pickle = self._get_io("f_pickle")
-            with open(f_pickle, "wb") as f:
-                pickle.dump(net, f)
-            params["f_pickle"] = f_pickle
+            f = self._get_io("f_pickle")
+            params["f_pickle"] = self._save_pickle(f, net)
 
-        if ddp_module:
-            net.module_ = ddp_module
+        net.module_ = wrapped_module
 
         epoch = net.history[-1]["epoch"]
+        self.last_saved_epoch_ = epoch
         keys_to_load = tuple(key for key in params.keys() if key != "f_pickle")
         train.save_checkpoint(
             _keys=keys_to_load,
             epoch=epoch,
-            **{k: v.getvalue()
-               for k, v in params.items() if v})
+            **{k: v
+               for k, v in params.items() if v is not None})
 
     def _save_params(self, f, net, f_name, log_name):
         try:
             net.save_params(**{f_name: f})
-            return f
+            return self._pop_value(f)
         except Exception as e:  # pylint: disable=broad-except
             self._sink(
                 "Unable to save {} to {}, {}: {}".format(
@@ -433,6 +530,25 @@ class TrainCheckpoint(Checkpoint, TrainSklearnCallback):
             return io.StringIO(value)
         return io.BytesIO(value)
 
+    def _save_pickle(self, f, net):
+        try:
+            # torch.save stores tensor data contiguously and is faster
+            # than plain pickle for modules. Load with torch.load.
+            torch.save(net, f)
+            return self._pop_value(f)
+        except Exception as e:  # pylint: disable=broad-except
+            self._sink(
+                "Unable to save model to {}, {}: {}".format(
+                    f,
+                    type(e).__name__, e), net.verbose)
+
+    def _pop_value(self, f):
+        """Get the contents of ``f`` and release its buffer right away,
+        so that only one saved item is held in memory twice at a time."""
+        value = f.getvalue()
+        f.close()
+        return value
+
 
 class TrainReportCallback(SortedKeysMixin, TrainSklearnCallback):
     """Report the last history entry from a worker to Ray Train.
@@ -459,9 +575,9 @@ class TrainReportCallback(SortedKeysMixin, TrainSklearnCallback):
 
     def on_epoch_end(self, net, **kwargs):
         history = net.history[-1]
+        keys_to_report = set(
+            self._sorted_keys(
+                history.keys(), self.keys_ignored_, filter_keys=False))
         train.report(
-            **{
-                k: v
-                for k, v in history.items() if k in self._sorted_keys(
-                    history.keys(), self.keys_ignored_, filter_keys=False)
-            })
+            **{k: v
+               for k, v in history.items() if k in keys_to_report})
@@ -1,8 +1,10 @@
 from pathlib import Path
-from typing import Any, Callable, List, Dict, Iterable, Set, Union, Optional
+from typing import (Any, Callable, List, Dict, Iterable, Set, Tuple, Union,
+                    Optional)
 from itertools import cycle
 from tabulate import tabulate
 import numpy as np
+import json
 import numbers
 import sys
 
@@ -13,18 +15,36 @@ from ray.train.callbacks import TrainingCallback
 from ray.train.callbacks.logging import TrainCallbackLogdirManager
 from ray.train.callbacks.results_preprocessors import \
     IndexedResultsPreprocessor
+from ray.util.ml_utils.json import SafeFallbackEncoder
 from ray_skorch.callbacks.constants import PROFILER_KEY, AGGREGATE_KEY
 from ray_skorch.callbacks.utils import SortedKeysMixin
 
 
-def max_and_argmax(val):
-    return np.max(val), np.argmax(val)
+def _take_at(val: np.ndarray, idx, axis=None):
+    if axis is None:
+        return val.flat[idx]
+    return np.take_along_axis(val, np.expand_dims(idx, axis),
+                              axis).squeeze(axis)
 
 
-def min_and_argmin(val):
-    return np.min(val), np.argmin(val)
+def max_and_argmax(val, axis=None):
+    idx = np.argmax(val, axis=axis)
+    return _take_at(np.asarray(val), idx, axis=axis), idx
 
 
+def min_and_argmin(val, axis=None):
+    idx = np.argmin(val, axis=axis)
+    return _take_at(np.asarray(val), idx, axis=axis), idx
+
+
+def _take(aggregate, idx: Tuple[int, int]):
+    if isinstance(aggregate, tuple):
+        return tuple(element[idx] for element in aggregate)
+    return aggregate[idx]
+
+
+# Aggregate funcs are called with a list of values of a key from all
+# workers that reported it.
 DEFAULT_AGGREGATE_FUNC = {
     "mean": np.mean,
     "median": np.median,
@@ -33,12 +53,23 @@ DEFAULT_AGGREGATE_FUNC = {
     "min": min_and_argmin
 }
 
+# Aggregate funcs which are instead called once for many keys with
+# a 3D array of shape (num_groups, num_workers, num_keys) and
+# ``axis=1``, like NumPy reductions.
+_VECTORIZED_AGGREGATE_FUNCS = (np.mean, np.median, np.std, max_and_argmax,
+                               min_and_argmin)
+
 DEFAULT_KEYS_TO_NOT_AGGREGATE = {
     "epoch", "_timestamp", "_training_iteration", "train_batch_size",
     "valid_batch_size", PROFILER_KEY, "valid_loss_best", "train_loss_best",
     "train_batch_count", "valid_batch_count"
 }
 
+# How a key is handled during aggregation
+_NOT_AGGREGATED = "not_aggregated"
+_LIST = "list"
+_NUMERIC = "numeric"
+
 DEFAULT_KEYS_TO_NOT_PRINT = {PROFILER_KEY, "batches"}
 
 DEFAULT_KEYS_TO_NOT_PRINT_TABLE = DEFAULT_KEYS_TO_NOT_PRINT.union(
@@ -71,7 +102,7 @@ class TBXProfilerCallback(TrainingCallback):
             if PROFILER_KEY in result and result[PROFILER_KEY]:
                 for trace in result[PROFILER_KEY]:
                     name, data, _ = trace
-                    with open(self.logdir.joinpath(Path(name)), "w") as f:
+                    with open(self.logdir.joinpath(Path(name)), "wb") as f:
                         f.write(data)
 
 
@@ -84,7 +115,7 @@ class HistoryLoggingCallback(TrainingCallback):
             keys_to_not_aggregate: Set[str] = DEFAULT_KEYS_TO_NOT_AGGREGATE,
             aggregate_method: str = "nested",
             aggregate_funcs: Dict[str, Callable[[List[
-                float]], float]] = DEFAULT_AGGREGATE_FUNC) -> None:
+                float]], Any]] = DEFAULT_AGGREGATE_FUNC) -> None:
         self._workers_to_log = self._validate_workers_to_log(workers_to_log)
         self._keys_to_not_aggregate = set(keys_to_not_aggregate or {})
         assert aggregate_method in ("nested", "flat")
@@ -92,6 +123,7 @@ class HistoryLoggingCallback(TrainingCallback):
         self._aggregate_funcs = aggregate_funcs
         self._log_path = None
         self._history = []
+        self._key_layouts = {}
 
     def _validate_workers_to_log(self, workers_to_log) -> List[int]:
         if not isinstance(workers_to_log, list):
@@ -111,40 +143,125 @@ class HistoryLoggingCallback(TrainingCallback):
         return workers_to_log
 
     def _get_aggregate_results(self, results: List[Dict]) -> Dict:
-        aggregate_results = {}
-
-        def _set_aggregate_key(aggregate_results: Dict, key: str,
-                               aggregate_key: List[float]):
-            if self._aggregate_method == "nested":
-                aggregate = {}
-                for func_key, func in self._aggregate_funcs.items():
-                    aggregate[func_key] = func(aggregate_key)
-                aggregate_results[key] = aggregate
-            elif self._aggregate_method == "flat":
-                for func_key, func in self._aggregate_funcs.items():
-                    aggregate_results[f"{key}_{func_key}"] = func(
-                        aggregate_key)
-
-        if not isinstance(results[0], dict):
-            return aggregate_results
-
-        for key, value in results[0].items():
+        return self._get_aggregate_results_many([results])[0]
+
+    def _get_aggregate_results_many(self,
+                                    groups: List[List[Dict]]) -> List[Dict]:
+        """Aggregate several groups of results at once.
+
+        Each group is a list of results to aggregate together - one
+        per worker. Groups with the same schema (eg. the entries of
+        ``batches``) are aggregated with a single call of every
+        vectorized aggregate function.
+        """
+        aggregate_results = [{} for _ in groups]
+
+        schemas = {}
+        for i, group in enumerate(groups):
+            if isinstance(group[0], dict):
+                schemas.setdefault((tuple(group[0]), len(group)), []).append(i)
+
+        for (schema, _), indices in schemas.items():
+            key_layout = self._key_layouts.get(schema)
+            if key_layout is None:
+                key_layout = self._get_key_layout(groups[indices[0]][0])
+                self._key_layouts[schema] = key_layout
+            self._aggregate_groups([groups[i] for i in indices], key_layout,
+                                   [aggregate_results[i] for i in indices])
+        return aggregate_results
+
+    def _aggregate_groups(self, groups: List[List[Dict]],
+                          key_layout: List[Tuple[str, str]],
+                          aggregate_results: List[Dict]):
+        """Aggregate groups of results with the same key layout and the
+        same number of results, into ``aggregate_results``."""
+        numeric_keys = [key for key, kind in key_layout if kind == _NUMERIC]
+        aggregates = {}
+        if numeric_keys:
+            # Values missing from a worker are NaN in ``values`` and
+            # False in ``present``. Keys missing from any worker are
+            # aggregated over the workers that reported them.
+            values = np.array(
+                [[[result.get(key, np.nan) for key in numeric_keys]
+                  for result in group] for group in groups],
+                dtype=np.float64)
+            present = np.array([[[key in result for key in numeric_keys]
+                                 for result in group] for group in groups])
+            complete = present.all(axis=(0, 1))
+            for func_key, func in self._aggregate_funcs.items():
+                if func in _VECTORIZED_AGGREGATE_FUNCS and complete.all():
+                    aggregates[func_key] = func(values, axis=1)
+                    continue
+                aggregate = np.empty(
+                    (len(groups), len(numeric_keys)), dtype=object)
+                for g, group in enumerate(groups):
+                    for k, key in enumerate(numeric_keys):
+                        if func in _VECTORIZED_AGGREGATE_FUNCS:
+                            aggregate[g, k] = func(
+                                values[g, present[g, :, k], k])
+                        else:
+                            aggregate[g, k] = func([
+                                result[key] for result in group
+                                if key in result
+                            ])
+                aggregates[func_key] = aggregate
+
+        list_results = {}
+        for key, kind in key_layout:
+            if kind == _LIST:
+                # aggregate the entries of all groups at once
+                entries = [[[
+                    result[key][i] for result in group if key in result
+                ] for i in range(len(group[0][key]))] for group in groups]
+                flat_results = iter(
+                    self._get_aggregate_results_many([
+                        entry for group_entries in entries
+                        for entry in group_entries
+                    ]))
+                list_results[key] = [[
+                    next(flat_results) for _ in group_entries
+                ] for group_entries in entries]
+
+        for g, (group, aggregate_result) in enumerate(
+                zip(groups, aggregate_results)):
+            k = 0
+            for key, kind in key_layout:
+                if kind == _NOT_AGGREGATED:
+                    aggregate_result[key] = group[0][key]
+                elif kind == _LIST:
+                    aggregate_result[key] = list_results[key][g]
+                else:
+                    self._set_aggregate_key(
+                        aggregate_result, key, {
+                            func_key: _take(aggregate, (g, k))
+                            for func_key, aggregate in aggregates.items()
+                        })
+                    k += 1
+
+    def _set_aggregate_key(self, aggregate_results: Dict, key: str,
+                           aggregate: Dict[str, Any]):
+        if self._aggregate_method == "nested":
+            aggregate_results[key] = aggregate
+        elif self._aggregate_method == "flat":
+            for func_key, func_value in aggregate.items():
+                aggregate_results[f"{key}_{func_key}"] = func_value
+
+    def _get_key_layout(self, result: Dict) -> List[Tuple[str, str]]:
+        """Get the keys of ``result`` in order, together with how they
+        should be aggregated. Keys that can't be aggregated are skipped.
+
+        As the schema of results is stable across epochs, the layout is
+        cached by ``_get_aggregate_results``.
+        """
+        key_layout = []
+        for key, value in result.items():
             if key in self._keys_to_not_aggregate:
-                aggregate_results[key] = value
+                key_layout.append((key, _NOT_AGGREGATED))
             elif isinstance(value, list):
-                aggregate_results[key] = []
-                for i, entry in enumerate(value):
-                    aggregate_results[key].append(
-                        self._get_aggregate_results([
-                            result[key][i] for result in results
-                            if key in result
-                        ]))
+                key_layout.append((key, _LIST))
             elif isinstance(value, numbers.Number):
-                aggregate_key = [
-                    result[key] for result in results if key in result
-                ]
-                _set_aggregate_key(aggregate_results, key, aggregate_key)
-        return aggregate_results
+                key_layout.append((key, _NUMERIC))
+        return key_layout
 
     def handle_result(self, results: List[Dict], **info):
         results_dict = {idx: val for idx, val in enumerate(results)}
@@ -153,6 +270,61 @@ class HistoryLoggingCallback(TrainingCallback):
         self._history.append(results_dict)
 
 
+class JsonLinesHistoryLoggingCallback(HistoryLoggingCallback):
+    """Logs the history to a JSON Lines file, with one line per result.
+
+    Unlike Ray Train's ``JsonLoggerCallback``, which reads and rewrites
+    the entire file on every result, the file is only appended to.
+    """
+    _default_filename = "history.jsonl"
+
+    def __init__(
+            self,
+            workers_to_log: Union[int, str, List[Union[int,
+                                                       str]]] = AGGREGATE_KEY,
+            *,
+            logdir: Optional[str] = None,
+            filename: Optional[str] = None,
+            keys_to_not_log: Set[str] = frozenset({PROFILER_KEY}),
+            keys_to_not_aggregate: Set[str] = DEFAULT_KEYS_TO_NOT_AGGREGATE,
+            aggregate_method: str = "nested",
+            aggregate_funcs: Dict[str, Callable[[List[
+                float]], Any]] = DEFAULT_AGGREGATE_FUNC) -> None:
+        self._filename = filename
+        self._logdir_manager = TrainCallbackLogdirManager(logdir=logdir)
+        self._keys_to_not_log = set(keys_to_not_log or {})
+        super().__init__(
+            workers_to_log=workers_to_log,
+            keys_to_not_aggregate=keys_to_not_aggregate,
+            aggregate_method=aggregate_method,
+            aggregate_funcs=aggregate_funcs)
+
+    @property
+    def log_path(self) -> Optional[Path]:
+        return self._log_path
+
+    def start_training(self, logdir: str, **info):
+        self._logdir_manager.setup_logdir(default_logdir=logdir)
+        filename = self._filename or self._default_filename
+        self._log_path = self._logdir_manager.logdir_path.joinpath(filename)
+        # Create an empty file so that we can append to it.
+        open(self._log_path, "w").close()
+
+    def handle_result(self, results: List[Dict], **info):
+        super().handle_result(results, **info)
+        results_to_log = {
+            worker_rank: {
+                k: v
+                for k, v in worker_results.items()
+                if k not in self._keys_to_not_log
+            }
+            for worker_rank, worker_results in self._history[-1].items()
+            if worker_rank in self._workers_to_log
+        }
+        with open(self._log_path, "a") as f:
+            f.write(json.dumps(results_to_log, cls=SafeFallbackEncoder) + "\n")
+
+
 class AbstractPrintCallback(HistoryLoggingCallback):
     def __init__(
             self,
@@ -162,8 +334,8 @@ class AbstractPrintCallback(HistoryLoggingCallback):
             keys_to_not_print: Set[str] = DEFAULT_KEYS_TO_NOT_PRINT,
             keys_to_not_aggregate: Set[str] = DEFAULT_KEYS_TO_NOT_AGGREGATE,
             aggregate_method: str = "nested",
-            aggregate_funcs: Dict[str, Callable[[List[
-                float]], float]] = DEFAULT_AGGREGATE_FUNC,
+            aggregate_funcs: Dict[str, Callable[[List[float]],
+                                                Any]] = DEFAULT_AGGREGATE_FUNC,
             sink: Callable[[Any], None] = pprint) -> None:
         self.keys_to_not_print = set(keys_to_not_print or {})
         self.sink = sink
@@ -187,15 +359,17 @@ class AbstractPrintCallback(HistoryLoggingCallback):
 
 class DetailedHistoryPrintCallback(SortedKeysMixin, AbstractPrintCallback):
     def display(self):
-        print_dict = {
-            worker_rank: {
+        print_dict = {}
+        for worker_rank, worker_results in self._history[-1].items():
+            if worker_rank not in self._workers_to_log:
+                continue
+            keys_to_print = set(
+                self._sorted_keys(worker_results.keys(),
+                                  self.keys_to_not_print))
+            print_dict[worker_rank] = {
                 k: v
-                for k, v in worker_results.items() if k in self._sorted_keys(
-                    worker_results.keys(), self.keys_to_not_print)
+                for k, v in worker_results.items() if k in keys_to_print
             }
-            for worker_rank, worker_results in self._history[-1].items()
-            if worker_rank in self._workers_to_log
-        }
         self._sink(print_dict)
 
 
@@ -210,8 +384,8 @@ class TableHistoryPrintCallback(SortedKeysMixin, AbstractPrintCallback):
             keys_to_not_print: Set[str] = DEFAULT_KEYS_TO_NOT_PRINT_TABLE,
             keys_to_not_aggregate: Set[str] = DEFAULT_KEYS_TO_NOT_AGGREGATE,
             aggregate_method: str = "nested",
-            aggregate_funcs: Dict[str, Callable[[List[
-                float]], float]] = DEFAULT_AGGREGATE_FUNC,
+            aggregate_funcs: Dict[str, Callable[[List[float]],
+                                                Any]] = DEFAULT_AGGREGATE_FUNC,
             aggregate_key_to_print: str = "mean",
             sink: Callable[[Any], None] = print,
             tablefmt="simple",
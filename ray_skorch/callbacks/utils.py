@@ -15,9 +15,18 @@ class SortedKeysMixin:
         This is a copy of a skorch method, modified to replace
         'dur' with 'dur_s' and to allow for toggling whether
         '*_best' or 'event_*' keys should be filtered.
+
+        As the keys are usually the same every epoch, the results
+        are cached.
         """
-        sorted_keys = []
         keys_ignored = keys_ignored or {}
+        cache_key = (frozenset(keys), frozenset(keys_ignored), filter_keys)
+        cache = self.__dict__.setdefault("_sorted_keys_cache", {})
+        if cache_key in cache:
+            return cache[cache_key]
+
+        sorted_keys = []
+        keys_sorted_alphabetically = sorted(keys)
 
         # make sure "epoch" comes first
         if ("epoch" in keys) and ("epoch" not in keys_ignored):
@@ -26,18 +35,17 @@ class SortedKeysMixin:
         # ignore keys like *_best or event_*
         if filter_keys:
             for key in filter_log_keys(
-                    sorted(keys), keys_ignored=keys_ignored):
+                    keys_sorted_alphabetically, keys_ignored=keys_ignored):
                 if key != "dur_s":
                     sorted_keys.append(key)
         else:
-            sorted_keys.extend(
-                sorted([
-                    key for key in keys
-                    if key not in keys_ignored and not key.startswith("event_")
-                ]))
+            sorted_keys.extend([
+                key for key in keys_sorted_alphabetically
+                if key not in keys_ignored and not key.startswith("event_")
+            ])
 
         # add event_* keys
-        for key in sorted(keys):
+        for key in keys_sorted_alphabetically:
             if key.startswith("event_") and (key not in keys_ignored):
                 sorted_keys.append(key)
 
@@ -45,4 +53,5 @@ class SortedKeysMixin:
         if ("dur_s" in keys) and ("dur_s" not in keys_ignored):
             sorted_keys.append("dur_s")
 
+        cache[cache_key] = sorted_keys
         return sorted_keys
@@ -40,7 +40,8 @@ import torch
 from ray.data import Dataset, from_pandas
 from ray.data.dataset_pipeline import DatasetPipeline
 from skorch.dataset import Dataset as SkorchDataset
-from skorch.utils import check_indexing, is_pandas_ndframe
+from skorch.utils import (check_indexing, get_len, is_pandas_ndframe,
+                          to_tensor)
 
 LABEL_COLUMN = "_label"
 
@@ -376,6 +377,19 @@ class PipelineIterator:
         such as ``CrossEntropyLoss`` require it to be 1D - for those, this
         argument should be set to False.
 
+    pin_memory : bool (default=False)
+        Whether to copy the tensors into pinned (page-locked) memory
+        before returning them. This allows for asynchronous host to
+        device copies when training on GPU.
+
+    cache_device : str, torch.device or None (default=None)
+        If not None, the batches of the first epoch are concatenated and
+        moved to this device once. Every epoch is then served by slicing
+        those tensors directly, without going through Ray Datasets or
+        doing host to device copies. If the dataset shuffles each window,
+        the rows are reshuffled every epoch with ``torch.randperm``.
+        The whole dataset shard must fit in the memory of the device.
+
     """
 
     def __init__(
@@ -390,7 +404,9 @@ class PipelineIterator:
                 str, List["torch.dtype"]], List[List["torch.dtype"]]]] = None,
             prefetch_blocks: int = 0,
             drop_last: bool = False,
-            unsqueeze_label_tensor: bool = True) -> None:
+            unsqueeze_label_tensor: bool = True,
+            pin_memory: bool = False,
+            cache_device: Optional[Union[str, "torch.device"]] = None) -> None:
         self._validate_feature_columns(skorch_dataset, feature_columns,
                                        feature_column_dtypes)
         self.skorch_dataset = skorch_dataset
@@ -401,7 +417,10 @@ class PipelineIterator:
         self.prefetch_blocks = prefetch_blocks
         self.drop_last = drop_last
         self.unsqueeze_label_tensor = unsqueeze_label_tensor
+        self.pin_memory = pin_memory
+        self.cache_device = cache_device
         self._iterator = skorch_dataset.X.iter_epochs()
+        self._cache = None
 
     def _validate_feature_columns(
             self, skorch_dataset: RayPipelineDataset,
@@ -425,7 +444,8 @@ class PipelineIterator:
             batch_size: int = 1,
             prefetch_blocks: int = 0,
             drop_last: bool = False,
-            unsqueeze_label_tensor: bool = False):
+            unsqueeze_label_tensor: bool = False,
+            pin_memory: bool = False):
         """Copy of Dataset.to_torch with support for returning dicts/lists."""
         from ray.data.impl.torch_iterable_dataset import \
             TorchIterableDataset
@@ -439,10 +459,15 @@ class PipelineIterator:
                                  "match!")
 
         def get_features_tensor(batch, feature_columns, feature_column_dtypes):
-            feature_tensors = []
             if feature_columns:
                 batch = batch[feature_columns]
 
+            # Fast path - a single conversion of the whole block instead of
+            # a tensor per column followed by a concatenation.
+            if not feature_column_dtypes and len(set(batch.dtypes)) == 1:
+                return torch.as_tensor(np.ascontiguousarray(batch.values))
+
+            feature_tensors = []
             if feature_column_dtypes:
                 dtypes = feature_column_dtypes
             else:
@@ -456,6 +481,52 @@ class PipelineIterator:
 
             return torch.cat(feature_tensors, dim=1)
 
+        def pin(tensors):
+            if isinstance(tensors, dict):
+                return {k: v.pin_memory() for k, v in tensors.items()}
+            if isinstance(tensors, list):
+                return [v.pin_memory() for v in tensors]
+            return tensors.pin_memory()
+
+        # Resolve the feature columns once, as they are the same for
+        # every batch.
+        feature_columns_not_none = (
+            feature_columns or self.skorch_dataset.X_multiple_input_columns)
+
+        if feature_columns_not_none:
+            iterator = feature_columns_not_none.items() if isinstance(
+                feature_columns_not_none,
+                dict) else enumerate(feature_columns_not_none)
+
+            use_multi_input = (self.skorch_dataset.X_multiple_input_columns
+                               or isinstance(next(iter(iterator))[1], list))
+
+            # reset iterator
+            iterator = feature_columns_not_none.items() if isinstance(
+                feature_columns_not_none,
+                dict) else enumerate(feature_columns_not_none)
+        else:
+            use_multi_input = False
+
+        multi_input_elements = []
+        if use_multi_input:
+            use_prefix = (self.skorch_dataset.X_multiple_input_columns
+                          and feature_columns)
+            for k, v in iterator:
+                # Add prefix only if it's not already there
+                prefix = k if use_prefix else ""
+                feature_columns_element = [
+                    f"{prefix}{col}" for col in feature_columns_not_none[k]
+                ]
+
+                if feature_column_dtypes:
+                    feature_column_dtypes_element = feature_column_dtypes[k]
+                else:
+                    feature_column_dtypes_element = None
+
+                multi_input_elements.append((k, feature_columns_element,
+                                             feature_column_dtypes_element))
+
         def make_generator():
             for batch in dataset.iter_batches(
                     batch_size=batch_size,
@@ -471,47 +542,11 @@ class PipelineIterator:
                 else:
                     label_tensor = None
 
-                feature_columns_not_none = (
-                    feature_columns
-                    or self.skorch_dataset.X_multiple_input_columns)
-
-                if feature_columns_not_none:
-                    iterator = feature_columns_not_none.items() if isinstance(
-                        feature_columns_not_none,
-                        dict) else enumerate(feature_columns_not_none)
-
-                    use_multi_input = (
-                        self.skorch_dataset.X_multiple_input_columns
-                        or isinstance(next(iter(iterator))[1], list))
-
-                    # reset iterator
-                    iterator = feature_columns_not_none.items() if isinstance(
-                        feature_columns_not_none,
-                        dict) else enumerate(feature_columns_not_none)
-                else:
-                    use_multi_input = False
-
                 if use_multi_input:
-                    use_prefix = (self.skorch_dataset.X_multiple_input_columns
-                                  and feature_columns)
                     features_tensor = type(feature_columns_not_none)()
-                    for k, v in iterator:
-                        # Add prefix only if it's not already there
-                        prefix = k if use_prefix else ""
-                        feature_columns_element = [
-                            f"{prefix}{col}"
-                            for col in feature_columns_not_none[k]
-                        ]
-
-                        if feature_column_dtypes:
-                            feature_column_dtypes_element = (
-                                feature_column_dtypes[k])
-                        else:
-                            feature_column_dtypes_element = None
-
+                    for k, columns, dtypes in multi_input_elements:
                         feature_tensor = get_features_tensor(
-                            batch, feature_columns_element,
-                            feature_column_dtypes_element)
+                            batch, columns, dtypes)
 
                         if isinstance(features_tensor, dict):
                             features_tensor[k] = feature_tensor
@@ -521,13 +556,17 @@ class PipelineIterator:
                     features_tensor = get_features_tensor(
                         batch, feature_columns, feature_column_dtypes)
 
+                if pin_memory:
+                    features_tensor = pin(features_tensor)
+                    if label_tensor is not None:
+                        label_tensor = pin(label_tensor)
+
                 yield (features_tensor, label_tensor)
 
         return TorchIterableDataset(make_generator)
 
-    def __iter__(self) -> Tuple[Union["torch.Tensor", List[
-            "torch.Tensor"], Dict[str, "torch.Tensor"]], "torch.Tensor"]:
-        yield from self.to_torch(
+    def _iter_epoch(self, drop_last: bool, pin_memory: bool):
+        return self.to_torch(
             next(self._iterator),
             label_column=self.skorch_dataset.y,
             batch_size=self.batch_size,
@@ -535,5 +574,63 @@ class PipelineIterator:
             label_column_dtype=self.label_column_dtype,
             feature_column_dtypes=self.feature_column_dtypes,
             prefetch_blocks=self.prefetch_blocks,
-            drop_last=self.drop_last,
-            unsqueeze_label_tensor=self.unsqueeze_label_tensor)
+            drop_last=drop_last,
+            unsqueeze_label_tensor=self.unsqueeze_label_tensor,
+            pin_memory=pin_memory)
+
+    def _build_cache(self) -> Tuple[Any, Optional["torch.Tensor"], int]:
+        def cat(tensors):
+            first = tensors[0]
+            if isinstance(first, dict):
+                return {k: torch.cat([t[k] for t in tensors]) for k in first}
+            if isinstance(first, list):
+                return [
+                    torch.cat([t[i] for t in tensors])
+                    for i in range(len(first))
+                ]
+            return torch.cat(tensors)
+
+        # keep the last incomplete batch so that no rows are left out
+        # of the cache - drop_last is applied when slicing instead
+        batches = list(self._iter_epoch(drop_last=False, pin_memory=False))
+        if not batches:
+            return None, None, 0
+
+        X = to_tensor(cat([Xi for Xi, _ in batches]), self.cache_device)
+        y = None
+        if batches[0][1] is not None:
+            y = to_tensor(cat([yi for _, yi in batches]), self.cache_device)
+        n = sum(get_len(Xi) for Xi, _ in batches)
+        return X, y, n
+
+    def _iter_cache(self):
+        def take(tensors, index):
+            if isinstance(tensors, dict):
+                return {k: v[index] for k, v in tensors.items()}
+            if isinstance(tensors, list):
+                return [v[index] for v in tensors]
+            return tensors[index]
+
+        if self._cache is None:
+            self._cache = self._build_cache()
+        X, y, n = self._cache
+
+        indices = None
+        if getattr(self.skorch_dataset, "random_shuffle_each_window", False):
+            indices = torch.randperm(n, device=self.cache_device)
+
+        stop = n - n % self.batch_size if self.drop_last else n
+        for start in range(0, stop, self.batch_size):
+            if indices is None:
+                index = slice(start, start + self.batch_size)
+            else:
+                index = indices[start:start + self.batch_size]
+            yield (take(X, index), take(y, index) if y is not None else None)
+
+    def __iter__(self) -> Tuple[Union["torch.Tensor", List[
+            "torch.Tensor"], Dict[str, "torch.Tensor"]], "torch.Tensor"]:
+        if self.cache_device is not None:
+            yield from self._iter_cache()
+        else:
+            yield from self._iter_epoch(
+                drop_last=self.drop_last, pin_memory=self.pin_memory)
@@ -44,6 +44,37 @@ _docstring_neural_net_ray_kwargs = """    profile : bool (default=False)
       Whether to enable or disable saving checkpoints (through
       a callback).
 
+    ddp_kwargs : dict or None (default=None)
+      kwargs passed to ``DistributedDataParallel`` when wrapping the
+      module. By default, ``find_unused_parameters`` and
+      ``gradient_as_bucket_view`` are set to True. For modules without
+      dynamic control flow, ``{"static_graph": True}`` can be passed
+      to further reduce the overhead.
+
+    compile_kwargs : dict or None (default=None)
+      If not None, the module will be compiled with ``torch.compile``
+      (requires torch>=2.0) with those kwargs after being wrapped in
+      ``DistributedDataParallel``. Only used for training - prediction
+      runs the module uncompiled. Defaults to ``dynamic=False``.
+      Pass ``{"mode": "reduce-overhead"}`` to use CUDA graphs on GPU.
+      Unless ``dynamic`` is True or ``iterator_train__drop_last`` is
+      set, the last incomplete training batch is dropped to avoid
+      recompilation.
+
+    autocast_kwargs : dict or None (default=None)
+      If not None, the forward pass and loss computation during training
+      will be run inside ``torch.autocast`` (requires torch>=1.10) with
+      those kwargs. Defaults to the device type of ``device`` and
+      ``dtype=torch.bfloat16``, which doesn't require gradient scaling.
+      Training predictions passed to callbacks are cast back to the
+      dtype of the module. Validation and prediction are not affected.
+
+    defer_batch_loss : bool (default=False)
+      If True, batch losses are kept on device and only recorded in
+      history at the end of the epoch, avoiding a device synchronization
+      after every batch. The batch losses will then not be available to
+      callbacks during ``on_batch_end`` (e.g. ``ProgressBar``).
+
 """  # noqa: E501
 
 _docstring_neural_net_ray_fit_params = """        X_val : validation data, compatible with skorch.dataset.Dataset
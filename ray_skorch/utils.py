@@ -4,9 +4,10 @@ from ray.train.session import get_session
 from ray.data.dataset import Dataset
 from ray.data.dataset_pipeline import DatasetPipeline
 
-from skorch.utils import is_dataset
+from skorch.utils import is_dataset, to_tensor
 
 import torch
+from torch.nn.parallel.distributed import DistributedDataParallel
 
 if TYPE_CHECKING:
     from ray_skorch.callbacks.skorch import (  # noqa: F401
@@ -30,6 +31,62 @@ def is_using_gpu(device: str) -> bool:
     return device == "cuda" and torch.cuda.is_available()
 
 
+def is_cuda_device(device: Union[str, "torch.device"]) -> bool:
+    return torch.device(device).type == "cuda"
+
+
+def to_tensor_non_blocking(X, device: Union[str, "torch.device"]):
+    """Same as ``skorch.utils.to_tensor``, but torch tensors are copied
+    to device with ``non_blocking=True``.
+
+    Combined with pinned memory, this allows host to device copies to
+    overlap with computation.
+    """
+    if isinstance(X, torch.Tensor) and device is not None:
+        return X.to(device, non_blocking=True)
+    if isinstance(X, dict):
+        return {
+            key: to_tensor_non_blocking(val, device)
+            for key, val in X.items()
+        }
+    if isinstance(X, (list, tuple)):
+        return [to_tensor_non_blocking(x, device) for x in X]
+    return to_tensor(X, device=device)
+
+
+def cast_floating_tensors(X, dtype: "torch.dtype"):
+    """Cast floating point torch tensors in ``X`` (which may also be
+    a dict, list or tuple) to ``dtype``."""
+    if isinstance(X, torch.Tensor):
+        return X.to(dtype) if X.is_floating_point() else X
+    if isinstance(X, dict):
+        return {
+            key: cast_floating_tensors(val, dtype)
+            for key, val in X.items()
+        }
+    if isinstance(X, list):
+        return [cast_floating_tensors(x, dtype) for x in X]
+    if isinstance(X, tuple):
+        return tuple(cast_floating_tensors(x, dtype) for x in X)
+    return X
+
+
+def unwrap_compiled(module: "torch.nn.Module") -> "torch.nn.Module":
+    """Get the original module from inside a ``torch.compile`` wrapper."""
+    # torch.compile returns an OptimizedModule keeping the original
+    # module as ``_orig_mod``
+    return getattr(module, "_orig_mod", module)
+
+
+def unwrap_module(module: "torch.nn.Module") -> "torch.nn.Module":
+    """Get the original module from inside ``DistributedDataParallel``
+    and ``torch.compile`` wrappers."""
+    module = unwrap_compiled(module)
+    if isinstance(module, DistributedDataParallel):
+        module = module.module
+    return unwrap_compiled(module)
+
+
 def insert_before_substring(base_string: str, string_to_insert: str,
                             substring: str) -> str:
     idx = base_string.index(substring)